@@ -1,21 +1,37 @@
 import os
 import base64
+import re
+import functools
 import hashlib
 import hmac
+import logging
 import secrets
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from time import monotonic, sleep
 from datetime import datetime, timedelta, time, date
 from zoneinfo import ZoneInfo
-from typing import List, Optional
+from typing import List, Literal, Optional
 
+from anyio import to_thread
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import MutableHeaders
+from jinja2 import Environment, FileSystemLoader
 from pydantic import BaseModel
-import psycopg
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, namedtuple_row
+from psycopg_pool import ConnectionPool, PoolTimeout
 import httpx
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from app.migrate import run_migrations
+
 # --- Env helpers ---
 def env(name: str, default: Optional[str] = None) -> str:
     val = os.getenv(name, default)
@@ -34,23 +50,114 @@ BREVO_API_KEY = os.getenv("BREVO_API_KEY")
 BREVO_SENDER_EMAIL = os.getenv("BREVO_SENDER_EMAIL")
 BREVO_SENDER_NAME = os.getenv("BREVO_SENDER_NAME", "CampusPulse")
 AUTH_DISABLED = os.getenv("AUTH_DISABLED", "false").lower() == "true"
+DEV = os.getenv("DEV", "false").lower() == "true"
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "false").lower() == "true"
+# Set when the app is only reachable over HTTPS (browsers drop Secure cookies on plain HTTP).
+COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() == "true"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "50"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "100"))
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "20"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
 
 DATABASE_URL = (
     f"host={DB_HOST} port={DB_PORT} dbname={DB_NAME} "
     f"user={DB_USER} password={DB_PASSWORD} sslmode={DB_SSLMODE}"
 )
 
-app = FastAPI(title="CampusPulse")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        on_startup()
+        yield
+    finally:
+        on_shutdown()
+
+
+app = FastAPI(title="CampusPulse", default_response_class=ORJSONResponse, lifespan=lifespan)
 _scheduler: Optional[BackgroundScheduler] = None
+_pool: Optional[ConnectionPool] = None
+_http: Optional[httpx.Client] = None
+_hash_pool: Optional[ThreadPoolExecutor] = None
 
 # Static JS
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    # Every pooled connection is busy: shed load quickly instead of queueing requests.
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+
+class NoStoreApiMiddleware:
+    # Plain ASGI rather than @app.middleware("http"), which wraps every request and
+    # response body in extra streaming tasks.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_no_store(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).setdefault("cache-control", "no-store")
+            await send(message)
+
+        await self.app(scope, receive, send_no_store)
+
+
+app.add_middleware(NoStoreApiMiddleware)
+
 # External API
 BVG_BASE_URL = "https://v6.bvg.transport.rest"
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 BREVO_EMAIL_URL = "https://api.brevo.com/v3/smtp/email"
 TZ = ZoneInfo("Europe/Berlin")
+CAMPUS_QUERY = "Campus Jungfernsee"
+
+
+class RateLimit:
+    # Lets `burst` calls through at once, then one every `interval` seconds, across
+    # the threads of this process.
+    def __init__(self, interval: float, burst: int = 1):
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tat = 0.0
+
+    def wait(self, max_wait: Optional[float] = None) -> bool:
+        # Blocks until the caller may go. With `max_wait`, gives up without taking a
+        # slot and returns False when the wait would be longer than that.
+        with self._lock:
+            now = monotonic()
+            tat = max(self._tat, now)
+            start = max(now, tat - (self.burst - 1) * self.interval)
+            if max_wait is not None and start - now > max_wait:
+                return False
+            self._tat = tat + self.interval
+        if start > now:
+            sleep(start - now)
+        return True
+
+
+# Nominatim's usage policy: at most one request per second. Callers queue for a few
+# seconds at most, beyond that they get a 503 instead of holding a request thread.
+_nominatim_rate = RateLimit(1.0)
+NOMINATIM_MAX_WAIT = 3.0
+# Reminder jobs only (interactive BVG routes are not throttled): BVG allows 100
+# requests/minute per IP, so a normal run goes out in one burst and a large one
+# slows down instead of collecting 429s.
+_reminder_bvg_rate = RateLimit(0.6, burst=100)
+
+logger = logging.getLogger(__name__)
 
 # Template (tiny: we just return it raw)
 INDEX_PATH = os.path.join("app", "templates", "index.html")
@@ -58,199 +165,85 @@ LOGIN_PATH = os.path.join("app", "templates", "login.html")
 SIGNUP_PATH = os.path.join("app", "templates", "signup.html")
 PROFILE_PATH = os.path.join("app", "templates", "profile.html")
 
+# path -> (body, etag); pages are static for the life of the process (re-read when DEV).
+_pages: dict[str, tuple[bytes, str]] = {}
+
+# Email bodies are rendered with Jinja (compiled once, autoescaped).
+_jinja = Environment(
+    loader=FileSystemLoader(os.path.join("app", "templates")),
+    autoescape=True,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+REMINDER_EMAIL_TEMPLATE = _jinja.get_template("reminder_email.html")
+
+# token -> (user row, expires_at); per-process, so a logout on another worker
+# is only seen here once the entry ages out.
+_session_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_session_cache_lock = threading.Lock()
+
+# Resolved stops/addresses barely change; keep them for a day so the reminder
+# jobs don't re-query BVG/Nominatim for the campus and every home address.
+# Only successful lookups are kept, so a miss is retried on the next call.
+_location_cache: TTLCache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+_location_cache_lock = threading.Lock()
+
+# Identical BVG GETs from many users within seconds (stop search, the same stop's
+# departures) are answered locally; stop lookups change rarely, so keep them longer.
+_bvg_locations_cache: TTLCache = TTLCache(maxsize=2048, ttl=5 * 60)
+_bvg_cache: TTLCache = TTLCache(maxsize=2048, ttl=30)
+_bvg_cache_lock = threading.Lock()
+
 
 def get_conn():
-    return psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    # Pooled connections are in autocommit mode: each statement commits on its own,
+    # so multi-statement writes must run inside `conn.transaction()`.
+    return _pool.connection()
+
+
+def get_http() -> httpx.Client:
+    # Shared client: keeps TLS connections to BVG/Nominatim/Brevo alive across calls.
+    return _http
 
 
 def init_db():
-    # Create table if not exists
+    # Schema changes live in app/migrations and are applied by `python -m app.migrate`
+    # at deploy time; startup only checks the DB is reachable.
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    email TEXT NOT NULL UNIQUE,
-                    password_hash TEXT NOT NULL,
-                    gdpr_confirm BOOLEAN NOT NULL DEFAULT FALSE,
-                    first_name TEXT,
-                    last_name TEXT,
-                    created_at TIMESTAMP NOT NULL DEFAULT NOW()
-                );
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE users
-                ADD COLUMN IF NOT EXISTS gdpr_confirm BOOLEAN NOT NULL DEFAULT FALSE;
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE users
-                ADD COLUMN IF NOT EXISTS first_name TEXT;
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE users
-                ADD COLUMN IF NOT EXISTS last_name TEXT;
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS classes (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    course_name TEXT NOT NULL,
-                    start_time TIMESTAMP NOT NULL,
-                    end_time TIMESTAMP NOT NULL,
-                    location TEXT NOT NULL,
-                    is_recurring BOOLEAN NOT NULL DEFAULT FALSE
-                );
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE classes
-                ADD COLUMN IF NOT EXISTS user_id INTEGER;
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE classes
-                ADD COLUMN IF NOT EXISTS end_time TIMESTAMP;
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE classes
-                ADD COLUMN IF NOT EXISTS is_recurring BOOLEAN NOT NULL DEFAULT FALSE;
-                """
-            )
-            cur.execute(
-                """
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1
-                        FROM information_schema.table_constraints
-                        WHERE constraint_name = 'classes_user_id_fkey'
-                          AND table_name = 'classes'
-                    ) THEN
-                        ALTER TABLE classes
-                        ADD CONSTRAINT classes_user_id_fkey
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
-                    END IF;
-                END
-                $$;
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    token TEXT NOT NULL UNIQUE,
-                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-                    expires_at TIMESTAMP NOT NULL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_preferences (
-                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                    allow_ubahn BOOLEAN NOT NULL DEFAULT TRUE,
-                    allow_sbahn BOOLEAN NOT NULL DEFAULT TRUE,
-                    allow_regional BOOLEAN NOT NULL DEFAULT TRUE,
-                    allow_tram BOOLEAN NOT NULL DEFAULT TRUE,
-                    allow_bus BOOLEAN NOT NULL DEFAULT TRUE,
-                    timing_pref TEXT NOT NULL DEFAULT 'earlier',
-                    arrival_time TEXT,
-                    home_location TEXT,
-                    reminder_time TEXT
-                );
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE user_preferences
-                ADD COLUMN IF NOT EXISTS home_location TEXT;
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE user_preferences
-                ADD COLUMN IF NOT EXISTS reminder_time TEXT;
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS email_notifications (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                    send_date DATE NOT NULL,
-                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-                    UNIQUE (user_id, send_date)
-                );
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE email_notifications
-                ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'daily';
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE email_notifications
-                ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP;
-                """
-            )
-            cur.execute(
-                """
-                DO $$
-                BEGIN
-                    IF EXISTS (
-                        SELECT 1
-                        FROM information_schema.table_constraints
-                        WHERE table_name = 'email_notifications'
-                          AND constraint_name = 'email_notifications_user_id_send_date_key'
-                    ) THEN
-                        ALTER TABLE email_notifications
-                        DROP CONSTRAINT email_notifications_user_id_send_date_key;
-                    END IF;
-                END
-                $$;
-                """
-            )
-            cur.execute(
-                """
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1
-                        FROM information_schema.table_constraints
-                        WHERE table_name = 'email_notifications'
-                          AND constraint_name = 'email_notifications_user_id_send_date_kind_key'
-                    ) THEN
-                        ALTER TABLE email_notifications
-                        ADD CONSTRAINT email_notifications_user_id_send_date_kind_key
-                        UNIQUE (user_id, send_date, kind);
-                    END IF;
-                END
-                $$;
-                """
-            )
-        conn.commit()
+        if RUN_MIGRATIONS:
+            run_migrations(conn)
+        else:
+            conn.execute("SELECT 1;")
 
 
-@app.on_event("startup")
 def on_startup():
+    global _pool, _http, _hash_pool, _scheduler
+    # Sync endpoints run on AnyIO's threadpool (40 threads by default); size it
+    # so blocking DB/HTTP calls can overlap up to the pool's capacity.
+    to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+    if _pool is None:
+        pool = ConnectionPool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            kwargs={"row_factory": dict_row, "autocommit": True},
+            check=ConnectionPool.check_connection,
+            timeout=DB_POOL_TIMEOUT,
+            num_workers=3,
+            open=True,
+        )
+        pool.wait()
+        _pool = pool
+    if _http is None:
+        _http = httpx.Client(
+            timeout=10.0,
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            headers={"User-Agent": "CampusPulse/1.0"},
+        )
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
     init_db()
-    global _scheduler
     if _scheduler is None:
         scheduler = BackgroundScheduler(timezone=str(TZ))
         scheduler.add_job(send_daily_reminders, "interval", minutes=1)
@@ -259,12 +252,20 @@ def on_startup():
         _scheduler = scheduler
 
 
-@app.on_event("shutdown")
 def on_shutdown():
-    global _scheduler
+    global _scheduler, _pool, _http, _hash_pool
     if _scheduler:
         _scheduler.shutdown()
         _scheduler = None
+    if _http:
+        _http.close()
+        _http = None
+    if _hash_pool:
+        _hash_pool.shutdown()
+        _hash_pool = None
+    if _pool:
+        _pool.close()
+        _pool = None
 
 
 class ClassIn(BaseModel):
@@ -290,12 +291,12 @@ class SignupIn(BaseModel):
 
 
 class PreferencesIn(BaseModel):
-    allow_ubahn: Optional[bool] = None
-    allow_sbahn: Optional[bool] = None
-    allow_regional: Optional[bool] = None
-    allow_tram: Optional[bool] = None
-    allow_bus: Optional[bool] = None
-    timing_pref: Optional[str] = None
+    allow_ubahn: bool = True
+    allow_sbahn: bool = True
+    allow_regional: bool = True
+    allow_tram: bool = True
+    allow_bus: bool = True
+    timing_pref: Literal["earlier", "later"] = "earlier"
     arrival_time: Optional[str] = None
     home_location: Optional[str] = None
     reminder_time: Optional[str] = None
@@ -307,18 +308,40 @@ class PasswordChangeIn(BaseModel):
     confirm_password: str
 
 
+# Argon2id with OWASP's 46 MiB / t=1 / p=1 profile.
+_password_hasher = PasswordHasher(time_cost=1, memory_cost=46 * 1024, parallelism=1)
+
+
 def hash_password(password: str) -> str:
-    salt = secrets.token_bytes(16)
-    iterations = 120_000
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
-    return "pbkdf2_sha256$%d$%s$%s" % (
-        iterations,
-        base64.b64encode(salt).decode("ascii"),
-        base64.b64encode(dk).decode("ascii"),
-    )
+    return _password_hasher.hash(password)
 
 
 def verify_password(password: str, stored: str) -> bool:
+    if stored.startswith("pbkdf2_"):
+        return verify_legacy_password(password, stored)
+    try:
+        return _password_hasher.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def run_hash(fn, *args):
+    # Argon2 (via cffi) and hashlib release the GIL, so a small dedicated pool runs
+    # hashes on separate cores while capping concurrent 46 MiB Argon2 buffers.
+    return _hash_pool.submit(fn, *args).result()
+
+
+def password_needs_rehash(stored: str) -> bool:
+    if stored.startswith("pbkdf2_"):
+        return True
+    try:
+        return _password_hasher.check_needs_rehash(stored)
+    except InvalidHashError:
+        return True
+
+
+def verify_legacy_password(password: str, stored: str) -> bool:
+    # Hashes written before the Argon2 switch; rehashed on next login.
     try:
         algo, iter_s, salt_b64, hash_b64 = stored.split("$", 3)
         if algo != "pbkdf2_sha256":
@@ -332,37 +355,115 @@ def verify_password(password: str, stored: str) -> bool:
     return hmac.compare_digest(dk, expected)
 
 
-def create_session(conn, user_id: int) -> str:
-    token = secrets.token_urlsafe(32)
-    expires_at = datetime.utcnow() + timedelta(days=7)
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO sessions (user_id, token, expires_at)
-            VALUES (%s, %s, %s);
-            """,
-            (user_id, token, expires_at),
-        )
-    return token
+def new_session_token() -> tuple[str, datetime]:
+    return secrets.token_urlsafe(32), datetime.utcnow() + timedelta(days=7)
+
+
+# Shape of secrets.token_urlsafe(32); anything else can't be a live session.
+SESSION_TOKEN_RE = re.compile(r"[A-Za-z0-9_-]{43}")
 
 
-def get_current_user(request: Request):
+def is_session_token(token: Optional[str]) -> bool:
+    return bool(token) and SESSION_TOKEN_RE.fullmatch(token) is not None
+
+
+def session_token_hash(token: str) -> bytes:
+    # Only the digest is stored; the raw token lives in the client's cookie.
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def get_current_user(request: Request, with_prefs: bool = False):
+    # With `with_prefs` the user also carries "prefs" (their user_preferences row, or
+    # None); on a session cache miss both come back in a single round trip.
     token = request.cookies.get("session")
-    if not token:
+    if not is_session_token(token):
         return None
+    user = cached_session_user(token)
+    if user and not with_prefs:
+        return user
     with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT u.id, u.email
-                FROM sessions s
-                JOIN users u ON u.id = s.user_id
-                WHERE s.token = %s AND s.expires_at > NOW();
-                """,
-                (token,),
-            )
+        if user:
+            return {**user, "prefs": preferences_row(conn, user["id"])}
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            if with_prefs:
+                cur.execute(
+                    """
+                    SELECT u.id, u.email, s.expires_at, p.user_id IS NOT NULL AS has_prefs,
+                           p.allow_ubahn, p.allow_sbahn, p.allow_regional, p.allow_tram,
+                           p.allow_bus, p.timing_pref, p.arrival_time, p.home_location, p.reminder_time
+                    FROM sessions s
+                    JOIN users u ON u.id = s.user_id
+                    LEFT JOIN user_preferences p ON p.user_id = u.id
+                    WHERE s.token_hash = %s AND s.expires_at > NOW();
+                    """,
+                    (session_token_hash(token),),
+                    prepare=True,
+                )
+            else:
+                cur.execute(
+                    """
+                    SELECT u.id, u.email, s.expires_at
+                    FROM sessions s
+                    JOIN users u ON u.id = s.user_id
+                    WHERE s.token_hash = %s AND s.expires_at > NOW();
+                    """,
+                    (session_token_hash(token),),
+                    prepare=True,
+                )
             row = cur.fetchone()
-    return row
+    if not row:
+        return None
+    user = {"id": row.id, "email": row.email}
+    remember_session(token, user, row.expires_at)
+    if with_prefs:
+        return {**user, "prefs": row if row.has_prefs else None}
+    return user
+
+
+def preferences_row(conn, user_id: int):
+    with conn.cursor(row_factory=namedtuple_row) as cur:
+        cur.execute(
+            """
+            SELECT allow_ubahn, allow_sbahn, allow_regional, allow_tram,
+                   allow_bus, timing_pref, arrival_time, home_location, reminder_time
+            FROM user_preferences
+            WHERE user_id = %s;
+            """,
+            (user_id,),
+            prepare=True,
+        )
+        return cur.fetchone()
+
+
+def set_session_cookie(response: Response, token: str):
+    response.set_cookie(
+        "session",
+        token,
+        httponly=True,
+        secure=COOKIE_SECURE,
+        samesite="lax",
+        max_age=60 * 60 * 24 * 7,
+    )
+
+
+def cached_session_user(token: str) -> Optional[dict]:
+    with _session_cache_lock:
+        cached = _session_cache.get(token)
+    if cached:
+        user, expires_at = cached
+        if expires_at > datetime.utcnow():
+            return user
+    return None
+
+
+def remember_session(token: str, user: dict, expires_at: datetime):
+    with _session_cache_lock:
+        _session_cache[token] = (user, expires_at)
+
+
+def forget_session(token: str):
+    with _session_cache_lock:
+        _session_cache.pop(token, None)
 
 
 def get_fallback_user():
@@ -372,44 +473,70 @@ def get_fallback_user():
             return cur.fetchone()
 
 
-def require_user(request: Request):
-    user = get_current_user(request)
-    if AUTH_DISABLED:
-        return user or get_fallback_user()
+def require_user(request: Request, with_prefs: bool = False):
+    user = get_current_user(request, with_prefs)
+    if AUTH_DISABLED and not user:
+        user = get_fallback_user()
+        if user and with_prefs:
+            with get_conn() as conn:
+                user = {**user, "prefs": preferences_row(conn, user["id"])}
+        return user
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     return user
 
+def load_page(path: str) -> tuple[bytes, str]:
+    page = None if DEV else _pages.get(path)
+    if page is None:
+        with open(path, "rb") as f:
+            body = f.read()
+        page = (body, '"%s"' % hashlib.sha256(body).hexdigest()[:32])
+        _pages[path] = page
+    return page
+
+
+def html_page(request: Request, path: str) -> Response:
+    body, etag = load_page(path)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
+
+def drop_stale_session(request: Request, response: Response) -> Response:
+    # Pages without a session cookie never touch the DB; make sure a cookie that no
+    # longer maps to a session stops costing a lookup on every page load.
+    if request.cookies.get("session"):
+        response.delete_cookie("session")
+    return response
+
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
     if not get_current_user(request):
-        return RedirectResponse("/login")
-    with open(INDEX_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+        return drop_stale_session(request, RedirectResponse("/login"))
+    return html_page(request, INDEX_PATH)
 
 
 @app.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
     if get_current_user(request):
         return RedirectResponse("/")
-    with open(LOGIN_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+    return drop_stale_session(request, html_page(request, LOGIN_PATH))
 
 
 @app.get("/signup", response_class=HTMLResponse)
 def signup_page(request: Request):
     if get_current_user(request):
         return RedirectResponse("/")
-    with open(SIGNUP_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+    return drop_stale_session(request, html_page(request, SIGNUP_PATH))
 
 
 @app.get("/profile", response_class=HTMLResponse)
 def profile_page(request: Request):
     if not get_current_user(request):
-        return RedirectResponse("/login")
-    with open(PROFILE_PATH, "r", encoding="utf-8") as f:
-        return f.read()
+        return drop_stale_session(request, RedirectResponse("/login"))
+    return html_page(request, PROFILE_PATH)
 
 
 @app.get("/api/db-test")
@@ -452,57 +579,66 @@ def delete_class(class_id: int, request: Request):
                 (class_id, user["id"]),
             )
             row = cur.fetchone()
-        conn.commit()
     if not row:
         raise HTTPException(status_code=404, detail="Class not found")
     return {"ok": True}
 
 
-def bvg_get(path: str, params: list[tuple[str, str]]):
+def bvg_get(path: str, params: list[tuple[str, str]], rate: Optional[RateLimit] = None):
+    cache = _bvg_locations_cache if path.startswith("/locations") else _bvg_cache
+    key = (path, tuple(params))
+    with _bvg_cache_lock:
+        data = cache.get(key)
+    if data is not None:
+        return data
     url = f"{BVG_BASE_URL}{path}"
+    if rate:
+        rate.wait()
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.get(url, params=params, headers={"User-Agent": "CampusPulse/1.0"})
+        resp = get_http().get(url, params=params)
         resp.raise_for_status()
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
     except httpx.RequestError as exc:
         raise HTTPException(status_code=502, detail=f"BVG request failed: {exc.__class__.__name__}")
-    return resp.json()
+    data = resp.json()
+    with _bvg_cache_lock:
+        cache[key] = data
+    return data
 
 
 @app.get("/api/bvg/locations")
 def bvg_locations(request: Request):
     require_user(request)
     params = list(request.query_params.multi_items())
-    return bvg_get("/locations", params)
+    return ORJSONResponse(bvg_get("/locations", params))
 
 
 @app.get("/api/bvg/locations/nearby")
 def bvg_locations_nearby(request: Request):
     require_user(request)
     params = list(request.query_params.multi_items())
-    return bvg_get("/locations/nearby", params)
+    return ORJSONResponse(bvg_get("/locations/nearby", params))
 
 
 @app.get("/api/public/locations/nearby")
 def public_locations_nearby(request: Request):
     params = list(request.query_params.multi_items())
-    return bvg_get("/locations/nearby", params)
+    return ORJSONResponse(bvg_get("/locations/nearby", params))
 
 
 @app.get("/api/bvg/stops/{stop_id}/departures")
 def bvg_departures(stop_id: str, request: Request):
     require_user(request)
     params = list(request.query_params.multi_items())
-    return bvg_get(f"/stops/{stop_id}/departures", params)
+    return ORJSONResponse(bvg_get(f"/stops/{stop_id}/departures", params))
 
 
 @app.get("/api/bvg/journeys")
 def bvg_journeys(request: Request):
     require_user(request)
     params = list(request.query_params.multi_items())
-    return bvg_get("/journeys", params)
+    return ORJSONResponse(bvg_get("/journeys", params))
 
 
 @app.get("/api/geocode")
@@ -518,9 +654,9 @@ def geocode(request: Request, query: str):
         "User-Agent": f"CampusPulse/1.0 ({GEOCODE_CONTACT})",
         "Accept-Language": "en",
     }
+    wait_for_nominatim()
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.get(NOMINATIM_URL, params=params, headers=headers)
+        resp = get_http().get(NOMINATIM_URL, params=params, headers=headers)
         resp.raise_for_status()
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
@@ -552,8 +688,7 @@ def notify_test(request: Request):
     }
     headers = {"api-key": BREVO_API_KEY, "content-type": "application/json"}
     try:
-        with httpx.Client(timeout=10.0) as client:
-            resp = client.post(BREVO_EMAIL_URL, json=payload, headers=headers)
+        resp = get_http().post(BREVO_EMAIL_URL, json=payload, headers=headers)
         resp.raise_for_status()
     except httpx.HTTPStatusError as exc:
         raise HTTPException(status_code=exc.response.status_code, detail=exc.response.text)
@@ -576,11 +711,11 @@ def notify_daily_test(request: Request):
     journey = None
     if home:
         origin = resolve_location(home)
-        destination = resolve_location("Campus Jungfernsee")
+        destination = resolve_location(CAMPUS_QUERY)
         journey = build_journey(origin, destination, prefs or {})
     sections = [("Route to Campus Jungfernsee", journey)]
     if home and last_end:
-        origin = resolve_location("Campus Jungfernsee")
+        origin = resolve_location(CAMPUS_QUERY)
         destination = resolve_location(home)
         back = build_journey(origin, destination, prefs or {}, departure_dt=last_end)
         sections.append(("Route home", back))
@@ -600,29 +735,93 @@ def extract_coords(item: dict) -> Optional[tuple[float, float]]:
     return None
 
 
+def stop_id_tail(val: Optional[str]) -> Optional[str]:
+    # "de:11000:900058101" -> "900058101"
+    if not val or not isinstance(val, str):
+        return None
+    return val.rpartition(":")[2] or None
+
+
 def normalize_stop_id(item: dict) -> Optional[str]:
     if not item:
         return None
-    def pick_id(val: Optional[str]) -> Optional[str]:
-        if not val or not isinstance(val, str):
-            return None
-        last = val.split(":")[-1]
-        return last or None
-    ibnr = pick_id(item.get("ibnr"))
+    ibnr = stop_id_tail(item.get("ibnr"))
     if ibnr and ibnr.isdigit():
         return ibnr
-    sid = pick_id(item.get("id"))
+    sid = stop_id_tail(item.get("id"))
     if sid and sid.isdigit():
         return sid
     station = item.get("station") or {}
-    sid = pick_id(station.get("id"))
+    sid = stop_id_tail(station.get("id"))
     if sid and sid.isdigit():
         return sid
     return None
 
 
-def resolve_location(query: str) -> dict:
-    items = bvg_get("/locations", [("query", query), ("results", "5")])
+def wait_for_nominatim():
+    if not _nominatim_rate.wait(max_wait=NOMINATIM_MAX_WAIT):
+        raise HTTPException(
+            status_code=503,
+            detail="Geocoding is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+
+def resolve_location(query: str, bvg_rate: Optional[RateLimit] = None) -> dict:
+    with _location_cache_lock:
+        location = _location_cache.get(query)
+    if location:
+        return location
+    location = load_cached_location(query)
+    if not location:
+        location = lookup_location(query, bvg_rate)
+        if not (location["id"] or location["coords"]):
+            return location
+        store_cached_location(query, location)
+    with _location_cache_lock:
+        _location_cache[query] = location
+    return location
+
+
+def load_cached_location(query: str) -> Optional[dict]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT name, lat, lon, stop_id
+                FROM geocode_cache
+                WHERE query = %s AND cached_at > NOW() - INTERVAL '30 days';
+                """,
+                (query,),
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    coords = (row["lat"], row["lon"]) if row["lat"] is not None else None
+    return {"id": row["stop_id"], "name": row["name"], "coords": coords}
+
+
+def store_cached_location(query: str, location: dict):
+    coords = location["coords"] or (None, None)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO geocode_cache (query, name, lat, lon, stop_id, cached_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (query) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    lat = EXCLUDED.lat,
+                    lon = EXCLUDED.lon,
+                    stop_id = EXCLUDED.stop_id,
+                    cached_at = EXCLUDED.cached_at;
+                """,
+                (query, location["name"], coords[0], coords[1], location["id"]),
+            )
+
+
+def lookup_location(query: str, bvg_rate: Optional[RateLimit] = None) -> dict:
+    items = bvg_get("/locations", [("query", query), ("results", "5")], bvg_rate)
     for item in items or []:
         stop_id = normalize_stop_id(item)
         if stop_id:
@@ -638,8 +837,8 @@ def resolve_location(query: str) -> dict:
         "User-Agent": f"CampusPulse/1.0 ({GEOCODE_CONTACT})",
         "Accept-Language": "en",
     }
-    with httpx.Client(timeout=10.0) as client:
-        resp = client.get(NOMINATIM_URL, params=params, headers=headers)
+    wait_for_nominatim()
+    resp = get_http().get(NOMINATIM_URL, params=params, headers=headers)
     resp.raise_for_status()
     data = resp.json()
     if not data:
@@ -669,25 +868,45 @@ def preferences_for_user(conn, user_id: int) -> dict:
     return row
 
 
+# Classes falling on a given day: one-off classes starting within it (half-open
+# range) plus recurring classes on the same ISO weekday.
+# Parameters: day start, next day start, ISO weekday.
+CLASSES_ON_DAY_SQL = """
+    ((NOT is_recurring AND start_time >= %s AND start_time < %s)
+     OR (is_recurring AND EXTRACT(ISODOW FROM start_time) = %s))
+"""
+
+
 def classes_for_day(conn, user_id: int, day: date) -> list[dict]:
-    start = datetime.combine(day, time.min)
-    end = datetime.combine(day, time.max)
+    return classes_for_users(conn, [user_id], day).get(user_id, [])
+
+
+def classes_for_users(conn, user_ids: list[int], day: date) -> dict[int, list[dict]]:
+    if not user_ids:
+        return {}
+    day_start = datetime.combine(day, time.min)
     with conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT course_name, start_time, end_time, location, is_recurring
+            f"""
+            SELECT user_id, course_name, start_time, end_time, location, is_recurring
             FROM classes
-            WHERE user_id = %s
-            ORDER BY start_time ASC;
+            WHERE user_id = ANY(%s) AND {CLASSES_ON_DAY_SQL}
+            ORDER BY user_id, start_time ASC;
             """,
-            (user_id,),
+            (user_ids, day_start, day_start + timedelta(days=1), day.isoweekday()),
         )
         rows = cur.fetchall()
+    return {
+        user_id: classes_on_day(list(user_rows), day)
+        for user_id, user_rows in groupby(rows, key=lambda r: r["user_id"])
+    }
+
+
+def classes_on_day(rows: list[dict], day: date) -> list[dict]:
+    # Rows are already filtered to `day`; move recurring ones onto that date.
     items = []
     for row in rows:
         if row["is_recurring"]:
-            if row["start_time"].weekday() != day.weekday():
-                continue
             st = datetime.combine(day, row["start_time"].time())
             et = datetime.combine(day, row["end_time"].time())
             items.append(
@@ -699,8 +918,6 @@ def classes_for_day(conn, user_id: int, day: date) -> list[dict]:
                 }
             )
         else:
-            if not (start <= row["start_time"] <= end):
-                continue
             items.append(row)
     items.sort(key=lambda r: r["start_time"])
     return items
@@ -719,55 +936,16 @@ def build_arrival_datetime(arrival_time_str: Optional[str], timing_pref: str) ->
     return target + timedelta(minutes=offset)
 
 
-def build_journey_table(title: str, journey: Optional[dict]) -> str:
-    if not journey:
-        return ""
-    legs = journey.get("legs") or []
-    leg_rows = ""
-    for leg in legs:
-        dep = (leg.get("departure") or "")[11:16]
-        arr = (leg.get("arrival") or "")[11:16]
-        mode = leg.get("line", {}).get("name") or leg.get("mode") or "Travel"
-        origin = leg.get("origin", {}).get("name") or "Start"
-        dest = leg.get("destination", {}).get("name") or "End"
-        leg_rows += f"<tr><td>{mode}</td><td>{dep}-{arr}</td><td>{origin} → {dest}</td></tr>"
-    return f"""
-      <h3 style="margin:20px 0 8px;">{title}</h3>
-      <table style="width:100%;border-collapse:collapse;">
-        <tr><th align="left">Line</th><th align="left">Time</th><th align="left">Segment</th></tr>
-        {leg_rows}
-      </table>
-    """
-
-
 def build_journey_email(
     user_email: str,
     classes: list[dict],
     sections: list[tuple[str, Optional[dict]]],
 ) -> str:
-    class_rows = ""
-    for c in classes:
-        start_str = c["start_time"].strftime("%H:%M")
-        end_str = c["end_time"].strftime("%H:%M") if c.get("end_time") else ""
-        time_str = f"{start_str}-{end_str}" if end_str else start_str
-        class_rows += f"<tr><td>{time_str}</td><td>{c['course_name']}</td><td>{c['location']}</td></tr>"
-    if not class_rows:
-        class_rows = "<tr><td colspan='3'>No classes today.</td></tr>"
-
-    journey_html = "".join(build_journey_table(title, journey) for title, journey in sections)
-
-    return f"""
-    <div style="font-family:Arial,sans-serif;color:#0f172a;line-height:1.4;">
-      <h2 style="margin:0 0 8px;">CampusPulse Daily Reminder</h2>
-      <p>Hello {user_email}, here is your schedule for today.</p>
-      <h3 style="margin:16px 0 8px;">Classes</h3>
-      <table style="width:100%;border-collapse:collapse;">
-        <tr><th align="left">Time</th><th align="left">Course</th><th align="left">Location</th></tr>
-        {class_rows}
-      </table>
-      {journey_html}
-    </div>
-    """
+    return REMINDER_EMAIL_TEMPLATE.render(
+        user_email=user_email,
+        classes=classes,
+        sections=sections,
+    )
 
 
 def send_brevo_email(to_email: str, subject: str, html: str):
@@ -780,8 +958,7 @@ def send_brevo_email(to_email: str, subject: str, html: str):
         "htmlContent": html,
     }
     headers = {"api-key": BREVO_API_KEY, "content-type": "application/json"}
-    with httpx.Client(timeout=10.0) as client:
-        resp = client.post(BREVO_EMAIL_URL, json=payload, headers=headers)
+    resp = get_http().post(BREVO_EMAIL_URL, json=payload, headers=headers)
     resp.raise_for_status()
 
 
@@ -790,6 +967,7 @@ def build_journey(
     destination: dict,
     prefs: dict,
     departure_dt: Optional[datetime] = None,
+    bvg_rate: Optional[RateLimit] = None,
 ) -> Optional[dict]:
     params = {"results": "3", "polylines": "false"}
     if origin.get("id") and destination.get("id"):
@@ -815,123 +993,227 @@ def build_journey(
         arrival = build_arrival_datetime(prefs.get("arrival_time"), prefs.get("timing_pref", "earlier"))
         if arrival:
             params["arrival"] = arrival.isoformat()
-    data = bvg_get("/journeys", list(params.items()))
+    data = bvg_get("/journeys", list(params.items()), bvg_rate)
     journeys = data.get("journeys") or []
     if not journeys:
         return None
     return journeys[0]
 
 
+# Advisory lock keys for scheduler jobs (one per job).
+DAILY_REMINDER_LOCK = 7_210_101
+RETURN_REMINDER_LOCK = 7_210_102
+
+
+def single_worker_job(lock_key: int):
+    # Every uvicorn worker runs its own scheduler; only the one holding the advisory
+    # lock does the work for a given tick, the others return immediately.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper():
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_try_advisory_lock(%s) AS locked;", (lock_key,))
+                    locked = cur.fetchone()["locked"]
+                if not locked:
+                    return
+                try:
+                    fn()
+                finally:
+                    conn.execute("SELECT pg_advisory_unlock(%s);", (lock_key,))
+        return wrapper
+    return decorator
+
+
+@single_worker_job(DAILY_REMINDER_LOCK)
 def send_daily_reminders():
     now = datetime.now(TZ)
     today = now.date()
     current_hm = now.strftime("%H:%M")
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, email FROM users;")
+            cur.execute(
+                """
+                SELECT u.id, u.email, p.allow_ubahn, p.allow_sbahn, p.allow_regional,
+                       p.allow_tram, p.allow_bus, p.timing_pref, p.arrival_time, p.home_location
+                FROM users u
+                JOIN user_preferences p ON p.user_id = u.id
+                LEFT JOIN email_notifications e
+                    ON e.user_id = u.id AND e.send_date = %s AND e.kind = 'daily'
+                WHERE p.reminder_time = %s AND e.id IS NULL;
+                """,
+                (today, current_hm),
+            )
             users = cur.fetchall()
-        for user in users:
-            user_id = user["id"]
-            email = user["email"]
-            prefs = preferences_for_user(conn, user_id)
-            reminder_time = (prefs or {}).get("reminder_time")
-            if not reminder_time or reminder_time != current_hm:
-                continue
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM email_notifications WHERE user_id = %s AND send_date = %s AND kind = %s;",
-                    (user_id, today, "daily"),
-                )
-                already = cur.fetchone()
-            if already:
-                continue
-            classes = classes_for_day(conn, user_id, today)
-            if not classes:
-                continue
-            home = prefs.get("home_location") if prefs else None
-            journey = None
-            if home:
-                origin = resolve_location(home)
-                destination = resolve_location("Campus Jungfernsee")
-                journey = build_journey(origin, destination, prefs or {})
-            sections = [("Route to Campus Jungfernsee", journey)]
-            if home:
-                last_end = last_class_end(conn, user_id, today)
-                if last_end:
-                    origin = resolve_location("Campus Jungfernsee")
-                    destination = resolve_location(home)
-                    back = build_journey(origin, destination, prefs or {}, departure_dt=last_end)
-                    sections.append(("Route home", back))
-            html = build_journey_email(email, classes, sections)
-            try:
-                send_brevo_email(email, "CampusPulse daily reminder", html)
-            except Exception:
-                continue
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO email_notifications (user_id, send_date, kind, sent_at)
-                    VALUES (%s, %s, %s, %s);
-                    """,
-                    (user_id, today, "daily", now),
+        classes_by_user = classes_for_users(conn, [u["id"] for u in users], today)
+    jobs = [(user, classes_by_user[user["id"]]) for user in users if classes_by_user.get(user["id"])]
+    campus = resolve_campus(jobs)
+    sent = run_parallel(lambda job: deliver_daily_reminder(*job, campus, today, now), jobs)
+    with get_conn() as conn:
+        record_notifications(conn, sent)
+
+
+def deliver_daily_reminder(
+    prefs: dict,
+    classes: list[dict],
+    campus: Optional[dict],
+    today: date,
+    now: datetime,
+) -> Optional[tuple]:
+    email = prefs["email"]
+    home = prefs.get("home_location")
+    if home and not campus:
+        logger.warning("Daily reminder for user %s skipped: campus location unavailable", prefs["id"])
+        return None
+    try:
+        journey = None
+        if home:
+            origin = resolve_location(home, _reminder_bvg_rate)
+            journey = build_journey(origin, campus, prefs, bvg_rate=_reminder_bvg_rate)
+        sections = [("Route to Campus Jungfernsee", journey)]
+        if home:
+            last_end = latest_end(classes)
+            if last_end:
+                destination = resolve_location(home, _reminder_bvg_rate)
+                back = build_journey(
+                    campus, destination, prefs, departure_dt=last_end, bvg_rate=_reminder_bvg_rate
                 )
-            conn.commit()
+                sections.append(("Route home", back))
+        html = build_journey_email(email, classes, sections)
+        send_brevo_email(email, "CampusPulse daily reminder", html)
+    except Exception:
+        logger.exception("Daily reminder for user %s failed", prefs["id"])
+        return None
+    return (prefs["id"], today, "daily", now)
 
 
-def last_class_end(conn, user_id: int, day: date) -> Optional[datetime]:
-    classes = classes_for_day(conn, user_id, day)
-    if not classes:
+def resolve_campus(jobs: list) -> Optional[dict]:
+    # Every routed reminder starts or ends at the campus: resolve it once up front
+    # instead of from each worker thread on a cold cache. None fails the routed
+    # reminders only; users without a home location still get their class list.
+    if not any(job[0].get("home_location") for job in jobs):
         return None
-    return max(c["end_time"] for c in classes if c.get("end_time"))
+    try:
+        return resolve_location(CAMPUS_QUERY, _reminder_bvg_rate)
+    except Exception:
+        logger.exception("Could not resolve %s for reminders", CAMPUS_QUERY)
+        return None
+
+
+def run_parallel(fn, jobs: list) -> list:
+    # Per-user reminder work is network-bound (BVG, Nominatim, Brevo); overlap it.
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(REMINDER_WORKERS, len(jobs))) as executor:
+        return [result for result in executor.map(fn, jobs) if result]
+
+
+def record_notifications(conn, rows: list[tuple]):
+    if not rows:
+        return
+    with conn.transaction(), conn.cursor() as cur:
+        cur.executemany(
+            """
+            INSERT INTO email_notifications (user_id, send_date, kind, sent_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT DO NOTHING;
+            """,
+            rows,
+        )
+
+
+def last_class_end(conn, user_id: int, day: date) -> Optional[datetime]:
+    return latest_end(classes_for_day(conn, user_id, day))
+
 
+def latest_end(classes: list[dict]) -> Optional[datetime]:
+    ends = [c["end_time"] for c in classes if c.get("end_time")]
+    return max(ends) if ends else None
 
+
+@single_worker_job(RETURN_REMINDER_LOCK)
 def send_return_reminders():
     now = datetime.now(TZ)
     today = now.date()
+    # Class times are stored as naive Berlin wall-clock times.
+    local_now = now.replace(tzinfo=None)
+    day_start = datetime.combine(today, time.min)
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, email FROM users;")
-            users = cur.fetchall()
-        for user in users:
-            user_id = user["id"]
-            email = user["email"]
-            last_end = last_class_end(conn, user_id, today)
-            if not last_end:
-                continue
-            target = last_end - timedelta(minutes=30)
-            if not (target <= now <= target + timedelta(minutes=5)):
-                continue
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM email_notifications WHERE user_id = %s AND send_date = %s AND kind = %s;",
-                    (user_id, today, "return"),
-                )
-                already = cur.fetchone()
-            if already:
-                continue
-            prefs = preferences_for_user(conn, user_id)
-            home = (prefs or {}).get("home_location")
-            journey = None
-            if home:
-                origin = resolve_location("Campus Jungfernsee")
-                destination = resolve_location(home)
-                journey = build_journey(origin, destination, prefs or {}, departure_dt=last_end)
-            classes = classes_for_day(conn, user_id, today)
-            sections = [("Route home", journey)]
-            html = build_journey_email(email, classes, sections)
-            try:
-                send_brevo_email(email, "CampusPulse reminder: time to head home", html)
-            except Exception:
-                continue
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO email_notifications (user_id, send_date, kind, sent_at)
-                    VALUES (%s, %s, %s, %s);
-                    """,
-                    (user_id, today, "return", now),
+            # Only users whose last class today ends 30-35 minutes from now and who
+            # haven't had a return reminder yet; usually no rows at all.
+            cur.execute(
+                f"""
+                WITH todays_classes AS (
+                    SELECT user_id,
+                           CASE WHEN is_recurring THEN %s::date + end_time::time
+                                ELSE end_time END AS end_time
+                    FROM classes
+                    WHERE {CLASSES_ON_DAY_SQL}
+                ),
+                due AS (
+                    SELECT user_id, MAX(end_time) AS last_end
+                    FROM todays_classes
+                    GROUP BY user_id
+                    HAVING MAX(end_time) - INTERVAL '30 minutes' BETWEEN %s AND %s
                 )
-            conn.commit()
+                SELECT u.id, u.email, d.last_end, p.allow_ubahn, p.allow_sbahn,
+                       p.allow_regional, p.allow_tram, p.allow_bus, p.timing_pref,
+                       p.arrival_time, p.home_location
+                FROM due d
+                JOIN users u ON u.id = d.user_id
+                LEFT JOIN user_preferences p ON p.user_id = u.id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM email_notifications e
+                    WHERE e.user_id = u.id AND e.send_date = %s AND e.kind = 'return'
+                );
+                """,
+                (
+                    today,
+                    day_start,
+                    day_start + timedelta(days=1),
+                    today.isoweekday(),
+                    local_now - timedelta(minutes=5),
+                    local_now,
+                    today,
+                ),
+            )
+            users = cur.fetchall()
+        classes_by_user = classes_for_users(conn, [u["id"] for u in users], today)
+    jobs = [(user, classes_by_user.get(user["id"]) or [], user["last_end"]) for user in users]
+    campus = resolve_campus(jobs)
+    sent = run_parallel(lambda job: deliver_return_reminder(*job, campus, today, now), jobs)
+    with get_conn() as conn:
+        record_notifications(conn, sent)
+
+
+def deliver_return_reminder(
+    prefs: dict,
+    classes: list[dict],
+    last_end: datetime,
+    campus: Optional[dict],
+    today: date,
+    now: datetime,
+) -> Optional[tuple]:
+    email = prefs["email"]
+    home = prefs.get("home_location")
+    if home and not campus:
+        logger.warning("Return reminder for user %s skipped: campus location unavailable", prefs["id"])
+        return None
+    try:
+        journey = None
+        if home:
+            destination = resolve_location(home, _reminder_bvg_rate)
+            journey = build_journey(
+                campus, destination, prefs, departure_dt=last_end, bvg_rate=_reminder_bvg_rate
+            )
+        sections = [("Route home", journey)]
+        html = build_journey_email(email, classes, sections)
+        send_brevo_email(email, "CampusPulse reminder: time to head home", html)
+    except Exception:
+        logger.exception("Return reminder for user %s failed", prefs["id"])
+        return None
+    return (prefs["id"], today, "return", now)
 
 
 @app.post("/api/classes", status_code=201)
@@ -955,7 +1237,6 @@ def create_class(payload: ClassIn, request: Request):
                 ),
             )
             row = cur.fetchone()
-        conn.commit()
     return row
 
 
@@ -982,7 +1263,6 @@ def update_class(class_id: int, payload: ClassIn, request: Request):
                 ),
             )
             row = cur.fetchone()
-        conn.commit()
     if not row:
         raise HTTPException(status_code=404, detail="Class not found")
     return row
@@ -1021,18 +1301,27 @@ def auth_signup(payload: SignupIn):
         raise HTTPException(status_code=400, detail="First and last name are required")
     if len(payload.password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
+    password_hash = run_hash(hash_password, payload.password)
+    token, expires_at = new_session_token()
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE email = %s;", (email,))
-            existing = cur.fetchone()
-            if existing:
-                raise HTTPException(status_code=409, detail="User already exists")
-            password_hash = hash_password(payload.password)
+            # One statement (so one round trip, atomic under autocommit): the user,
+            # their home location if given, and the first session.
             cur.execute(
                 """
-                INSERT INTO users (email, password_hash, gdpr_confirm, first_name, last_name)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id, email;
+                WITH u AS (
+                    INSERT INTO users (email, password_hash, gdpr_confirm, first_name, last_name)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (email_norm) DO NOTHING
+                    RETURNING id, email
+                ), p AS (
+                    INSERT INTO user_preferences (user_id, home_location)
+                    SELECT id, %s FROM u WHERE %s
+                ), s AS (
+                    INSERT INTO sessions (user_id, token_hash, expires_at)
+                    SELECT id, %s, %s FROM u
+                )
+                SELECT id, email FROM u;
                 """,
                 (
                     email,
@@ -1040,28 +1329,18 @@ def auth_signup(payload: SignupIn):
                     payload.gdpr_confirm,
                     payload.first_name.strip(),
                     payload.last_name.strip(),
+                    payload.home_location,
+                    bool(payload.home_location),
+                    session_token_hash(token),
+                    expires_at,
                 ),
             )
             user = cur.fetchone()
-            if payload.home_location:
-                cur.execute(
-                    """
-                    INSERT INTO user_preferences (user_id, home_location)
-                    VALUES (%s, %s)
-                    ON CONFLICT (user_id) DO UPDATE SET home_location = EXCLUDED.home_location;
-                    """,
-                    (user["id"], payload.home_location),
-                )
-            token = create_session(conn, user["id"])
-        conn.commit()
-    response = HTMLResponse(content="", status_code=204)
-    response.set_cookie(
-        "session",
-        token,
-        httponly=True,
-        samesite="lax",
-        max_age=60 * 60 * 24 * 7,
-    )
+    if not user:
+        raise HTTPException(status_code=409, detail="User already exists")
+    remember_session(token, user, expires_at)
+    response = Response(status_code=204)
+    set_session_cookie(response, token)
     return response
 
 
@@ -1071,34 +1350,52 @@ def auth_login(payload: AuthIn):
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT id, email, password_hash FROM users WHERE email = %s;",
+                "SELECT id, email, password_hash FROM users WHERE email_norm = %s;",
                 (email,),
+                prepare=True,
             )
             user = cur.fetchone()
-            if not user or not verify_password(payload.password, user["password_hash"]):
-                raise HTTPException(status_code=401, detail="Invalid credentials")
-            token = create_session(conn, user["id"])
-        conn.commit()
-    response = HTMLResponse(content="", status_code=204)
-    response.set_cookie(
-        "session",
-        token,
-        httponly=True,
-        samesite="lax",
-        max_age=60 * 60 * 24 * 7,
-    )
+    # Verify with no connection checked out, so a login burst queued on the hash pool
+    # can't drain the DB pool; failed attempts never write anything.
+    if not user or not run_hash(verify_password, payload.password, user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    new_hash = None
+    if password_needs_rehash(user["password_hash"]):
+        new_hash = run_hash(hash_password, payload.password)
+    token, expires_at = new_session_token()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO sessions (user_id, token_hash, expires_at)
+                VALUES (%s, %s, %s);
+                """,
+                (user["id"], session_token_hash(token), expires_at),
+                prepare=True,
+            )
+            if new_hash:
+                cur.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s;",
+                    (new_hash, user["id"]),
+                )
+    remember_session(token, {"id": user["id"], "email": user["email"]}, expires_at)
+    response = Response(status_code=204)
+    set_session_cookie(response, token)
     return response
 
 
 @app.post("/api/auth/logout")
 def auth_logout(request: Request):
     token = request.cookies.get("session")
-    if token:
+    if is_session_token(token):
+        forget_session(token)
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM sessions WHERE token = %s;", (token,))
-            conn.commit()
-    response = HTMLResponse(content="", status_code=204)
+                cur.execute(
+                    "DELETE FROM sessions WHERE token_hash = %s;",
+                    (session_token_hash(token),),
+                )
+    response = Response(status_code=204)
     response.delete_cookie("session")
     return response
 
@@ -1117,79 +1414,56 @@ def auth_change_password(payload: PasswordChangeIn, request: Request):
                 (user["id"],),
             )
             row = cur.fetchone()
-            if not row or not verify_password(payload.old_password, row["password_hash"]):
-                raise HTTPException(status_code=401, detail="Old password is incorrect")
-            new_hash = hash_password(payload.new_password)
-            cur.execute(
-                "UPDATE users SET password_hash = %s WHERE id = %s;",
-                (new_hash, user["id"]),
-            )
-        conn.commit()
+    # Both Argon2 rounds run with no connection checked out.
+    if not row or not run_hash(verify_password, payload.old_password, row["password_hash"]):
+        raise HTTPException(status_code=401, detail="Old password is incorrect")
+    new_hash = run_hash(hash_password, payload.new_password)
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE users SET password_hash = %s WHERE id = %s;",
+            (new_hash, user["id"]),
+        )
     return {"ok": True}
 
 
+PREF_DEFAULTS = {
+    "allow_ubahn": True,
+    "allow_sbahn": True,
+    "allow_regional": True,
+    "allow_tram": True,
+    "allow_bus": True,
+    "timing_pref": "earlier",
+    "arrival_time": "",
+    "home_location": "",
+    "reminder_time": "",
+}
+
+
 @app.get("/api/preferences")
 def get_preferences(request: Request):
-    user = require_user(request)
-    defaults = {
-        "allow_ubahn": True,
-        "allow_sbahn": True,
-        "allow_regional": True,
-        "allow_tram": True,
-        "allow_bus": True,
-        "timing_pref": "earlier",
-        "arrival_time": "",
-        "home_location": "",
-        "reminder_time": "",
-    }
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT allow_ubahn, allow_sbahn, allow_regional, allow_tram,
-                       allow_bus, timing_pref, arrival_time, home_location, reminder_time
-                FROM user_preferences
-                WHERE user_id = %s;
-                """,
-                (user["id"],),
-            )
-            row = cur.fetchone()
-    if not row:
-        return defaults
+    prefs = require_user(request, with_prefs=True)["prefs"]
+    return ORJSONResponse(preferences_out(prefs) if prefs else PREF_DEFAULTS)
+
+
+def preferences_out(row) -> dict:
     return {
-        "allow_ubahn": row["allow_ubahn"],
-        "allow_sbahn": row["allow_sbahn"],
-        "allow_regional": row["allow_regional"],
-        "allow_tram": row["allow_tram"],
-        "allow_bus": row["allow_bus"],
-        "timing_pref": row["timing_pref"],
-        "arrival_time": row["arrival_time"] or "",
-        "home_location": row["home_location"] or "",
-        "reminder_time": row["reminder_time"] or "",
+        "allow_ubahn": row.allow_ubahn,
+        "allow_sbahn": row.allow_sbahn,
+        "allow_regional": row.allow_regional,
+        "allow_tram": row.allow_tram,
+        "allow_bus": row.allow_bus,
+        "timing_pref": row.timing_pref,
+        "arrival_time": row.arrival_time or "",
+        "home_location": row.home_location or "",
+        "reminder_time": row.reminder_time or "",
     }
 
 
 @app.post("/api/preferences")
 def save_preferences(payload: PreferencesIn, request: Request):
     user = require_user(request)
-    timing_pref = payload.timing_pref or "earlier"
-    if timing_pref not in {"earlier", "later"}:
-        raise HTTPException(status_code=400, detail="Invalid timing preference")
-    current_home = None
-    current_reminder = None
-    if payload.home_location is None or payload.reminder_time is None:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT home_location, reminder_time FROM user_preferences WHERE user_id = %s;",
-                    (user["id"],),
-                )
-                row = cur.fetchone()
-                if row:
-                    current_home = row["home_location"]
-                    current_reminder = row["reminder_time"]
     with get_conn() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor(row_factory=namedtuple_row) as cur:
             cur.execute(
                 """
                 INSERT INTO user_preferences (
@@ -1205,21 +1479,24 @@ def save_preferences(payload: PreferencesIn, request: Request):
                     allow_bus = EXCLUDED.allow_bus,
                     timing_pref = EXCLUDED.timing_pref,
                     arrival_time = EXCLUDED.arrival_time,
-                    home_location = EXCLUDED.home_location,
-                    reminder_time = EXCLUDED.reminder_time;
+                    home_location = COALESCE(EXCLUDED.home_location, user_preferences.home_location),
+                    reminder_time = COALESCE(EXCLUDED.reminder_time, user_preferences.reminder_time)
+                RETURNING allow_ubahn, allow_sbahn, allow_regional, allow_tram,
+                          allow_bus, timing_pref, arrival_time, home_location, reminder_time;
                 """,
                 (
                     user["id"],
-                    payload.allow_ubahn if payload.allow_ubahn is not None else True,
-                    payload.allow_sbahn if payload.allow_sbahn is not None else True,
-                    payload.allow_regional if payload.allow_regional is not None else True,
-                    payload.allow_tram if payload.allow_tram is not None else True,
-                    payload.allow_bus if payload.allow_bus is not None else True,
-                    timing_pref,
+                    payload.allow_ubahn,
+                    payload.allow_sbahn,
+                    payload.allow_regional,
+                    payload.allow_tram,
+                    payload.allow_bus,
+                    payload.timing_pref,
                     payload.arrival_time or None,
-                    payload.home_location if payload.home_location is not None else current_home,
-                    payload.reminder_time if payload.reminder_time is not None else current_reminder,
+                    payload.home_location,
+                    payload.reminder_time,
                 ),
+                prepare=True,
             )
-        conn.commit()
-    return {"ok": True}
+            row = cur.fetchone()
+    return ORJSONResponse(preferences_out(row))
@@ -0,0 +1,50 @@
+"""Apply the SQL files in app/migrations in order, each exactly once.
+
+Run once per deploy, before starting the web workers:
+
+    python -m app.migrate
+"""
+import os
+
+import psycopg
+from psycopg.rows import tuple_row
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+# Serializes concurrent runners (e.g. several containers starting at once).
+MIGRATION_LOCK_KEY = 7_210_001
+
+
+def run_migrations(conn) -> list[str]:
+    applied_now = []
+    with conn.transaction(), conn.cursor(row_factory=tuple_row) as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        cur.execute("SELECT name FROM schema_migrations;")
+        applied = {name for (name,) in cur.fetchall()}
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if not name.endswith(".sql") or name in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name), "r", encoding="utf-8") as f:
+                cur.execute(f.read())
+            cur.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (name,))
+            applied_now.append(name)
+    return applied_now
+
+
+def main():
+    from app.main import DATABASE_URL
+
+    with psycopg.connect(DATABASE_URL) as conn:
+        applied = run_migrations(conn)
+    print("Applied: " + ", ".join(applied) if applied else "Schema up to date")
+
+
+if __name__ == "__main__":
+    main()
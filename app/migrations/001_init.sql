@@ -0,0 +1,134 @@
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    gdpr_confirm BOOLEAN NOT NULL DEFAULT FALSE,
+    first_name TEXT,
+    last_name TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS gdpr_confirm BOOLEAN NOT NULL DEFAULT FALSE;
+
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS first_name TEXT;
+
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS last_name TEXT;
+
+CREATE TABLE IF NOT EXISTS classes (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    course_name TEXT NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP NOT NULL,
+    location TEXT NOT NULL,
+    is_recurring BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+ALTER TABLE classes
+ADD COLUMN IF NOT EXISTS user_id INTEGER;
+
+ALTER TABLE classes
+ADD COLUMN IF NOT EXISTS end_time TIMESTAMP;
+
+ALTER TABLE classes
+ADD COLUMN IF NOT EXISTS is_recurring BOOLEAN NOT NULL DEFAULT FALSE;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.table_constraints
+        WHERE constraint_name = 'classes_user_id_fkey'
+          AND table_name = 'classes'
+    ) THEN
+        ALTER TABLE classes
+        ADD CONSTRAINT classes_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_classes_user_start
+ON classes (user_id, start_time);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    token TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_preferences (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    allow_ubahn BOOLEAN NOT NULL DEFAULT TRUE,
+    allow_sbahn BOOLEAN NOT NULL DEFAULT TRUE,
+    allow_regional BOOLEAN NOT NULL DEFAULT TRUE,
+    allow_tram BOOLEAN NOT NULL DEFAULT TRUE,
+    allow_bus BOOLEAN NOT NULL DEFAULT TRUE,
+    timing_pref TEXT NOT NULL DEFAULT 'earlier',
+    arrival_time TEXT,
+    home_location TEXT,
+    reminder_time TEXT
+);
+
+ALTER TABLE user_preferences
+ADD COLUMN IF NOT EXISTS home_location TEXT;
+
+ALTER TABLE user_preferences
+ADD COLUMN IF NOT EXISTS reminder_time TEXT;
+
+CREATE TABLE IF NOT EXISTS email_notifications (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    send_date DATE NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (user_id, send_date)
+);
+
+ALTER TABLE email_notifications
+ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'daily';
+
+ALTER TABLE email_notifications
+ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM information_schema.table_constraints
+        WHERE table_name = 'email_notifications'
+          AND constraint_name = 'email_notifications_user_id_send_date_key'
+    ) THEN
+        ALTER TABLE email_notifications
+        DROP CONSTRAINT email_notifications_user_id_send_date_key;
+    END IF;
+END
+$$;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.table_constraints
+        WHERE table_name = 'email_notifications'
+          AND constraint_name = 'email_notifications_user_id_send_date_kind_key'
+    ) THEN
+        ALTER TABLE email_notifications
+        ADD CONSTRAINT email_notifications_user_id_send_date_kind_key
+        UNIQUE (user_id, send_date, kind);
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    query TEXT PRIMARY KEY,
+    name TEXT,
+    lat DOUBLE PRECISION,
+    lon DOUBLE PRECISION,
+    stop_id TEXT,
+    cached_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
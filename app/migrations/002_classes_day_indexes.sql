@@ -0,0 +1,9 @@
+-- Serve CLASSES_ON_DAY_SQL across all users (return-reminder job): one-off classes
+-- by start time, recurring classes by ISO weekday.
+CREATE INDEX IF NOT EXISTS idx_classes_start_one_off
+ON classes (start_time)
+WHERE NOT is_recurring;
+
+CREATE INDEX IF NOT EXISTS idx_classes_recurring_isodow
+ON classes ((EXTRACT(ISODOW FROM start_time)))
+WHERE is_recurring;
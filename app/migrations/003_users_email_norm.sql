@@ -0,0 +1,7 @@
+-- Login and signup match on the normalized address, so casing or stray whitespace
+-- in rows written outside the API can't create lookalike accounts or miss the index.
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS email_norm TEXT GENERATED ALWAYS AS (lower(btrim(email))) STORED;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_norm
+ON users (email_norm);
@@ -0,0 +1,14 @@
+-- Keep only a SHA-256 of each session token, so a leaked table or backup can't be
+-- replayed as cookies. Existing sessions stay valid: their hash is backfilled.
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS token_hash BYTEA;
+
+UPDATE sessions
+SET token_hash = sha256(convert_to(token, 'UTF8'))
+WHERE token_hash IS NULL;
+
+ALTER TABLE sessions ALTER COLUMN token_hash SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_token_hash
+ON sessions (token_hash);
+
+ALTER TABLE sessions DROP COLUMN IF EXISTS token;